@@ -76,15 +76,23 @@ class JmxMixin(object):
         start_time_sec = min([min(time_to_stats.keys()) for time_to_stats in self.jmx_stats])
         end_time_sec = max([max(time_to_stats.keys()) for time_to_stats in self.jmx_stats])
 
+        # keep a running sum and maximum per attribute while walking the time range once
+        totals = {name: 0 for name in object_attribute_names}
+        maximums = {name: float('-inf') for name in object_attribute_names}
+        for time_sec in xrange(start_time_sec, end_time_sec + 1):
+            stats_per_node = [time_to_stats.get(time_sec, {}) for time_to_stats in self.jmx_stats]
+            for name in object_attribute_names:
+                # assume that value is 0 if it is not read by jmx tool at the given time, and that value is aggregated
+                # across nodes by sum. This is appropriate for metrics such as bandwidth
+                aggregate = sum(stats.get(name, 0) for stats in stats_per_node)
+                totals[name] += aggregate
+                if aggregate > maximums[name]:
+                    maximums[name] = aggregate
+
+        num_seconds = end_time_sec - start_time_sec + 1
         for name in object_attribute_names:
-            aggregates_per_time = []
-            for time_sec in xrange(start_time_sec, end_time_sec + 1):
-                # assume that value is 0 if it is not read by jmx tool at the given time. This is appropriate for metrics such as bandwidth
-                values_per_node = [time_to_stats.get(time_sec, {}).get(name, 0) for time_to_stats in self.jmx_stats]
-                # assume that value is aggregated across nodes by sum. This is appropriate for metrics such as bandwidth
-                aggregates_per_time.append(sum(values_per_node))
-            self.average_jmx_value[name] = sum(aggregates_per_time) / len(aggregates_per_time)
-            self.maximum_jmx_value[name] = max(aggregates_per_time)
+            self.average_jmx_value[name] = totals[name] / num_seconds
+            self.maximum_jmx_value[name] = maximums[name]
 
     def read_jmx_output_all_nodes(self):
         for node in self.nodes:
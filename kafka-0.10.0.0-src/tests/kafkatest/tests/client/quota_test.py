@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
+from collections import namedtuple
+
 from ducktape.tests.test import Test
 from ducktape.mark import parametrize
 
@@ -22,6 +25,19 @@ from kafkatest.services.performance import ProducerPerformanceService
 from kafkatest.services.console_consumer import ConsoleConsumer
 
 
+def parse_quota_overrides(overrides):
+    """Parse a quota overrides string such as 'client1=3000000,client2=4000000' into a dict"""
+    overridden_quotas = {}
+    for override in overrides.split(','):
+        client_id, _, quota = override.partition('=')
+        overridden_quotas[client_id] = quota
+    return overridden_quotas
+
+
+# a quota check of the maximum JMX value of service against quota_bps, allowing the 'client' or 'broker' deviation
+ThroughputCheck = namedtuple('ThroughputCheck', ['name', 'service', 'attribute_name', 'quota_owner', 'quota_bps', 'kind'])
+
+
 class QuotaTest(Test):
     """
     These tests verify that quota provides expected functionality -- they run
@@ -29,6 +45,10 @@ class QuotaTest(Test):
     check that the observed throughput is close to the value we expect.
     """
 
+    _JMX_OBJECT_NAMES = ('kafka.server:type=BrokerTopicMetrics,name=BytesInPerSec',
+                         'kafka.server:type=BrokerTopicMetrics,name=BytesOutPerSec')
+    _JMX_ATTRIBUTES = ('OneMinuteRate',)
+
     def __init__(self, test_context):
         """:type test_context: ducktape.tests.test.TestContext"""
         super(QuotaTest, self).__init__(test_context=test_context)
@@ -41,10 +61,16 @@ class QuotaTest(Test):
                              'quota_consumer_default': 2000000,
                              'quota_producer_bytes_per_second_overrides': 'overridden_id=3750000',
                              'quota_consumer_bytes_per_second_overrides': 'overridden_id=3000000'}
+        self._producer_overrides = parse_quota_overrides(self.quota_config['quota_producer_bytes_per_second_overrides'])
+        self._consumer_overrides = parse_quota_overrides(self.quota_config['quota_consumer_bytes_per_second_overrides'])
         self.maximum_client_deviation_percentage = 100.0
         self.maximum_broker_deviation_percentage = 5.0
-        self.num_records = 100000
+        # size the workload so that the fastest producer runs for about 90 seconds at its quota
+        self.produce_duration_sec = 90
         self.record_size = 3000
+        maximum_producer_quota = max([float(self.quota_config['quota_producer_default'])] +
+                                     [float(quota) for quota in self._producer_overrides.values()])
+        self.num_records = int(math.ceil(self.produce_duration_sec * maximum_producer_quota / self.record_size))
 
         self.zk = ZookeeperService(test_context, num_nodes=1)
         self.kafka = KafkaService(test_context, num_nodes=1, zk=self.zk,
@@ -52,9 +78,8 @@ class QuotaTest(Test):
                                   interbroker_security_protocol='PLAINTEXT',
                                   topics={self.topic: {'partitions': 6, 'replication-factor': 1, 'configs': {'min.insync.replicas': 1}}},
                                   quota_config=self.quota_config,
-                                  jmx_object_names=['kafka.server:type=BrokerTopicMetrics,name=BytesInPerSec',
-                                                    'kafka.server:type=BrokerTopicMetrics,name=BytesOutPerSec'],
-                                  jmx_attributes=['OneMinuteRate'])
+                                  jmx_object_names=self._JMX_OBJECT_NAMES,
+                                  jmx_attributes=self._JMX_ATTRIBUTES)
         self.num_producers = 1
         self.num_consumers = 2
 
@@ -69,7 +94,8 @@ class QuotaTest(Test):
     @parametrize(producer_id='default_id', producer_num=1, consumer_id='default_id', consumer_num=1)
     @parametrize(producer_id='overridden_id', producer_num=1, consumer_id='overridden_id', consumer_num=1)
     @parametrize(producer_id='overridden_id', producer_num=1, consumer_id='overridden_id', consumer_num=2)
-    def test_quota(self, producer_id='default_id', producer_num=1, consumer_id='default_id', consumer_num=1):
+    @parametrize(producer_id='overridden_id', producer_num=1, run_consumer=False)
+    def test_quota(self, producer_id='default_id', producer_num=1, consumer_id='default_id', consumer_num=1, run_consumer=True):
         # Produce all messages
         producer = ProducerPerformanceService(
             self.test_context, producer_num, self.kafka,
@@ -78,21 +104,23 @@ class QuotaTest(Test):
 
         producer.run()
 
-        # Consume all messages
-        consumer = ConsoleConsumer(self.test_context, consumer_num, self.kafka, self.topic,
-            new_consumer=False,
-            consumer_timeout_ms=60000, client_id=consumer_id,
-            jmx_object_names=['kafka.consumer:type=ConsumerTopicMetrics,name=BytesPerSec,clientId=%s' % consumer_id],
-            jmx_attributes=['OneMinuteRate'])
-        consumer.run()
+        # Consume all messages, unless only the producer quota is under test
+        consumer = None
+        if run_consumer:
+            consumer = ConsoleConsumer(self.test_context, consumer_num, self.kafka, self.topic,
+                new_consumer=False,
+                consumer_timeout_ms=60000, client_id=consumer_id,
+                jmx_object_names=['kafka.consumer:type=ConsumerTopicMetrics,name=BytesPerSec,clientId=%s' % consumer_id],
+                jmx_attributes=['OneMinuteRate'])
+            consumer.run()
 
-        for idx, messages in consumer.messages_consumed.iteritems():
-            assert len(messages) > 0, "consumer %d didn't consume any message before timeout" % idx
+            idle_consumers = [idx for idx, messages in consumer.messages_consumed.items() if not messages]
+            assert not idle_consumers, "consumer(s) %s didn't consume any message before timeout" % idle_consumers
 
         success, msg = self.validate(self.kafka, producer, consumer)
         assert success, msg
 
-    def validate(self, broker, producer, consumer):
+    def validate(self, broker, producer, consumer=None, fail_fast=False):
         """
         For each client_id we validate that:
         1) number of consumed messages equals number of produced messages
@@ -100,71 +128,72 @@ class QuotaTest(Test):
         3) maximum_broker_byte_in_rate <= producer_quota * (1 + maximum_broker_deviation_percentage/100)
         4) maximum_consumer_throughput <= consumer_quota * (1 + maximum_client_deviation_percentage/100)
         5) maximum_broker_byte_out_rate <= consumer_quota * (1 + maximum_broker_deviation_percentage/100)
+
+        Checks 1, 4 and 5 are skipped if consumer is None. If fail_fast is True, validation stops at the first
+        failed check without looking up the JMX values of the remaining checks.
         """
-        success = True
-        msg = ''
-
-        self.kafka.read_jmx_output_all_nodes()
-
-        # validate that number of consumed messages equals number of produced messages
-        produced_num = sum([value['records'] for value in producer.results])
-        consumed_num = sum([len(value) for value in consumer.messages_consumed.values()])
-        self.logger.info('producer produced %d messages' % produced_num)
-        self.logger.info('consumer consumed %d messages' % consumed_num)
-        if produced_num != consumed_num:
-            success = False
-            msg += "number of produced messages %d doesn't equal number of consumed messages %d" % (produced_num, consumed_num)
-
-        # validate that maximum_producer_throughput <= producer_quota * (1 + maximum_client_deviation_percentage/100)
-        producer_attribute_name = 'kafka.producer:type=producer-metrics,client-id=%s:outgoing-byte-rate' % producer.client_id
-        producer_maximum_bps = producer.maximum_jmx_value[producer_attribute_name]
+        failed_checks = []
+
+        # the broker JMX log must be read after all clients have finished
+        broker.read_jmx_output_all_nodes()
+
+        broker_byte_in_attribute_name, broker_byte_out_attribute_name = \
+            ['%s:%s' % (object_name, self._JMX_ATTRIBUTES[0]) for object_name in self._JMX_OBJECT_NAMES]
         producer_quota_bps = self.get_producer_quota(producer.client_id)
-        self.logger.info('producer has maximum throughput %.2f bps with producer quota %.2f bps' % (producer_maximum_bps, producer_quota_bps))
-        if producer_maximum_bps > producer_quota_bps*(self.maximum_client_deviation_percentage/100+1):
-            success = False
-            msg += 'maximum producer throughput %.2f bps exceeded producer quota %.2f bps by more than %.1f%%' % \
-                   (producer_maximum_bps, producer_quota_bps, self.maximum_client_deviation_percentage)
-
-        # validate that maximum_broker_byte_in_rate <= producer_quota * (1 + maximum_broker_deviation_percentage/100)
-        broker_byte_in_attribute_name = 'kafka.server:type=BrokerTopicMetrics,name=BytesInPerSec:OneMinuteRate'
-        broker_maximum_byte_in_bps = broker.maximum_jmx_value[broker_byte_in_attribute_name]
-        self.logger.info('broker has maximum byte-in rate %.2f bps with producer quota %.2f bps' %
-                         (broker_maximum_byte_in_bps, producer_quota_bps))
-        if broker_maximum_byte_in_bps > producer_quota_bps*(self.maximum_broker_deviation_percentage/100+1):
-            success = False
-            msg += 'maximum broker byte-in rate %.2f bps exceeded producer quota %.2f bps by more than %.1f%%' % \
-                   (broker_maximum_byte_in_bps, producer_quota_bps, self.maximum_broker_deviation_percentage)
-
-        # validate that maximum_consumer_throughput <= consumer_quota * (1 + maximum_client_deviation_percentage/100)
-        consumer_attribute_name = 'kafka.consumer:type=ConsumerTopicMetrics,name=BytesPerSec,clientId=%s:OneMinuteRate' % consumer.client_id
-        consumer_maximum_bps = consumer.maximum_jmx_value[consumer_attribute_name]
-        consumer_quota_bps = self.get_consumer_quota(consumer.client_id)
-        self.logger.info('consumer has maximum throughput %.2f bps with consumer quota %.2f bps' % (consumer_maximum_bps, consumer_quota_bps))
-        if consumer_maximum_bps > consumer_quota_bps*(self.maximum_client_deviation_percentage/100+1):
-            success = False
-            msg += 'maximum consumer throughput %.2f bps exceeded consumer quota %.2f bps by more than %.1f%%' % \
-                   (consumer_maximum_bps, consumer_quota_bps, self.maximum_client_deviation_percentage)
-
-        # validate that maximum_broker_byte_out_rate <= consumer_quota * (1 + maximum_broker_deviation_percentage/100)
-        broker_byte_out_attribute_name = 'kafka.server:type=BrokerTopicMetrics,name=BytesOutPerSec:OneMinuteRate'
-        broker_maximum_byte_out_bps = broker.maximum_jmx_value[broker_byte_out_attribute_name]
-        self.logger.info('broker has maximum byte-out rate %.2f bps with consumer quota %.2f bps' %
-                         (broker_maximum_byte_out_bps, consumer_quota_bps))
-        if broker_maximum_byte_out_bps > consumer_quota_bps*(self.maximum_broker_deviation_percentage/100+1):
-            success = False
-            msg += 'maximum broker byte-out rate %.2f bps exceeded consumer quota %.2f bps by more than %.1f%%' % \
-                   (broker_maximum_byte_out_bps, consumer_quota_bps, self.maximum_broker_deviation_percentage)
-
-        return success, msg
+        throughput_checks = [
+            ThroughputCheck('producer throughput', producer,
+                            'kafka.producer:type=producer-metrics,client-id=%s:outgoing-byte-rate' % producer.client_id,
+                            'producer', producer_quota_bps, 'client'),
+            ThroughputCheck('broker byte-in rate', broker, broker_byte_in_attribute_name,
+                            'producer', producer_quota_bps, 'broker')]
+
+        if consumer is not None:
+            # validate that number of consumed messages equals number of produced messages
+            produced_num = sum(value['records'] for value in producer.results)
+            consumed_num = sum(map(len, consumer.messages_consumed.values()))
+            self.logger.info('producer produced %d messages', produced_num)
+            self.logger.info('consumer consumed %d messages', consumed_num)
+            if produced_num != consumed_num:
+                self.logger.warning("number of produced messages %d doesn't equal number of consumed messages %d",
+                                    produced_num, consumed_num)
+                failed_checks.append('message count')
+                if fail_fast:
+                    return False, self._failure_summary(failed_checks)
+
+            consumer_quota_bps = self.get_consumer_quota(consumer.client_id)
+            throughput_checks += [
+                ThroughputCheck('consumer throughput', consumer,
+                                'kafka.consumer:type=ConsumerTopicMetrics,name=BytesPerSec,clientId=%s:OneMinuteRate' % consumer.client_id,
+                                'consumer', consumer_quota_bps, 'client'),
+                ThroughputCheck('broker byte-out rate', broker, broker_byte_out_attribute_name,
+                                'consumer', consumer_quota_bps, 'broker')]
+
+        # validate that maximum_bps <= quota_bps * (1 + deviation_percentage/100)
+        deviation_percentages = {'client': self.maximum_client_deviation_percentage,
+                                 'broker': self.maximum_broker_deviation_percentage}
+        deviation_multipliers = {kind: 1 + percentage / 100 for kind, percentage in deviation_percentages.items()}
+        for check in throughput_checks:
+            deviation_percentage = deviation_percentages[check.kind]
+            deviation_multiplier = deviation_multipliers[check.kind]
+            maximum_bps = check.service.maximum_jmx_value[check.attribute_name]
+            self.logger.info('maximum %s is %.2f bps with %s quota %.2f bps',
+                             check.name, maximum_bps, check.quota_owner, check.quota_bps)
+            if maximum_bps > check.quota_bps * deviation_multiplier:
+                self.logger.warning('maximum %s %.2f bps exceeded %s quota %.2f bps by more than %.1f%%',
+                                    check.name, maximum_bps, check.quota_owner, check.quota_bps, deviation_percentage)
+                failed_checks.append(check.name)
+                if fail_fast:
+                    return False, self._failure_summary(failed_checks)
+
+        if failed_checks:
+            return False, self._failure_summary(failed_checks)
+        return True, ''
+
+    def _failure_summary(self, failed_checks):
+        return 'failed checks: %s (see warnings above)' % ', '.join(failed_checks)
 
     def get_producer_quota(self, client_id):
-        overridden_quotas = {value.split('=')[0]:value.split('=')[1] for value in self.quota_config['quota_producer_bytes_per_second_overrides'].split(',')}
-        if client_id in overridden_quotas:
-            return float(overridden_quotas[client_id])
-        return self.quota_config['quota_producer_default']
+        return float(self._producer_overrides.get(client_id, self.quota_config['quota_producer_default']))
 
     def get_consumer_quota(self, client_id):
-        overridden_quotas = {value.split('=')[0]:value.split('=')[1] for value in self.quota_config['quota_consumer_bytes_per_second_overrides'].split(',')}
-        if client_id in overridden_quotas:
-            return float(overridden_quotas[client_id])
-        return self.quota_config['quota_consumer_default']
+        return float(self._consumer_overrides.get(client_id, self.quota_config['quota_consumer_default']))